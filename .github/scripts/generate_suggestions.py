@@ -1,96 +1,276 @@
 import os
+import re
 import argparse
+import functools
+import gzip
+import hashlib
+import io
+import orjson
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 # --- Configuration ---
 # Load Perplexity API Key from environment variable (set via GitHub Secrets!)
 API_KEY = os.getenv("PERPLEXITY_API_KEY")
 API_URL = "https://api.perplexity.ai/chat/completions"
 MODEL_NAME = "sonar" # Using a fast and capable model
+# Opt-in: gzip request bodies (only if the API accepts Content-Encoding: gzip)
+GZIP_REQUESTS = os.getenv("PERPLEXITY_GZIP_REQUESTS") == "1"
+
+# On-disk cache of LLM responses, keyed by a hash of model + prompt.
+# CI persists this directory between runs (see ai-test-doc-generation.yml).
+LLM_CACHE_DIR = Path(os.getenv("LLM_CACHE_DIR", ".cache/llm"))
+LLM_CACHE_SIZE = 64
+
+# Max characters of diff sent to the model per language
+DIFF_CHAR_LIMIT = 4000
+
+# Section headers used in the output markdown
+PY_HEADER = "### 🐍 Backend Test Suggestions"
+FE_HEADER = "### ⚛️ Frontend Test Suggestions"
+
+# Diff lines are matched as raw bytes so discarded lines are never decoded
+_OLD_FILE_RE = re.compile(rb"^--- (?:a/(.+)|/dev/null)$")
+_NEW_FILE_RE = re.compile(rb"^\+\+\+ (?:b/(.+)|/dev/null)$")
+_DIFF_LINE_RE = re.compile(rb"^[+-]")
+
+# Markers the model is asked to emit when both languages share one prompt
+_SECTION_RE = re.compile(r"^##\s+(PY_TESTS|FE_TESTS)\s*$", re.M)
+
+# Connect fails fast; the read timeout leaves room for slow generations
+API_TIMEOUT = (5, 60)
+
+# --- HTTP Session ---
+class _LoggingRetry(Retry):
+    """
+    urllib3 Retry that prints each retry so it shows up in the CI log.
+    """
+
+    def increment(self, *args, **kwargs):
+        new_retry = super().increment(*args, **kwargs)
+        print(f"Retrying Perplexity API call ({new_retry.total} retries left)")
+        return new_retry
+
+# One pooled session for the whole run so repeated calls reuse the
+# TLS connection to the API instead of handshaking every time.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=2,
+    pool_maxsize=8,
+    max_retries=_LoggingRetry(
+        total=3,
+        connect=3,
+        read=1,
+        status=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["POST"])
+    )
+))
+_SESSION.headers.update({
+    "Authorization": f"Bearer {API_KEY}",
+    "Content-Type": "application/json"
+})
 
 # --- Main Functions ---
 
-def call_llm(prompt, max_tokens=800):
+def _store_cached_response(cache_path, content):
     """
-    Sends a prompt to the Perplexity API and returns the text response.
+    Saves a response to the LLM cache, evicting the oldest entries past the cap.
+    """
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Same temp-file-and-swap as the output file, so a killed run can't
+        # leave a truncated entry behind
+        tmp_path = cache_path.with_suffix(".tmp")
+        tmp_path.write_text(content)
+        os.replace(tmp_path, cache_path)
+        entries = sorted(cache_path.parent.glob("*.txt"), key=lambda p: p.stat().st_mtime)
+        for stale in entries[:-LLM_CACHE_SIZE]:
+            stale.unlink(missing_ok=True)
+    except OSError:
+        pass # The cache is best-effort; never fail the run over it
+
+def request_llm(prompt, max_tokens=800):
+    """
+    Sends a prompt to the Perplexity API.
+
+    Returns a `(text, ok)` tuple; `ok` is False when `text` is an error
+    message rather than a completion. Successful responses are cached on
+    disk, so re-runs on the same diff skip the network call.
     """
     if not API_KEY:
-        return "Error: PERPLEXITY_API_KEY not set."
-        
+        return "Error: PERPLEXITY_API_KEY not set.", False
+
+    key = hashlib.blake2b(f"{MODEL_NAME}|{max_tokens}|{prompt}".encode(), digest_size=16).hexdigest()
+    cache_path = LLM_CACHE_DIR / f"{key}.txt"
+    try:
+        return cache_path.read_text(), True
+    except (OSError, UnicodeDecodeError):
+        pass # Missing or unreadable entry, treat it as a cache miss
+
     try:
-        response = requests.post(
+        # Encode with orjson ourselves rather than via requests' json= kwarg
+        body = orjson.dumps({
+            "model": MODEL_NAME,
+            "messages": [{
+                "role": "user",
+                "content": prompt
+            }],
+            "max_tokens": max_tokens
+        })
+        headers = None
+        if GZIP_REQUESTS:
+            body = gzip.compress(body)
+            headers = {"Content-Encoding": "gzip"}
+        response = _SESSION.post(
             API_URL,
-            headers={
-                "Authorization": f"Bearer {API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": MODEL_NAME,
-                "messages": [{
-                    "role": "user",
-                    "content": prompt
-                }],
-                "max_tokens": max_tokens
-            },
-            timeout=60
+            data=body,
+            headers=headers,
+            timeout=API_TIMEOUT
         )
         response.raise_for_status() # Raise an exception for bad status codes
-        
-        result = response.json()
-        content = result.get("choices", [{}])[0].get("message", {}).get("content", "No result!")
-        return content
     except requests.RequestException as e:
-        return f"Error calling Perplexity API: {e}"
-    except (KeyError, IndexError):
-        return f"Error parsing API response: {response.text}"
+        return f"Error calling Perplexity API: {e}", False
+
+    # Only the first choice's text is used; anything else in the body is ignored
+    try:
+        content = orjson.loads(response.content)["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError, orjson.JSONDecodeError):
+        # TypeError: a null along the path, e.g. "choices": null
+        content = None
+    if not isinstance(content, str):
+        return f"Error parsing API response: {response.text}", False
 
-def get_file_content(file_path):
+    _store_cached_response(cache_path, content)
+    return content, True
+
+def call_llm(prompt, max_tokens=800):
     """
-    Safely reads the content of a file.
+    Sends a prompt to the Perplexity API and returns the text response.
+    """
+    text, _ = request_llm(prompt, max_tokens)
+    return text
+
+@functools.lru_cache(maxsize=32)
+def get_file_content(file_path, max_chars=None):
+    """
+    Safely reads the content of a file, or only its first `max_chars` characters.
     """
     try:
         with open(file_path, "r") as f:
-            return f.read()
+            return f.read(max_chars)
     except FileNotFoundError:
         return None
 
-def handle_python_changes(diff_content, changed_files, openapi_content):
+def get_python_files(changed_files):
     """
-    Generates suggestions for Python code changes (Pytest, DRF tests).
+    Returns the changed backend Python files.
     """
-    py_files = [f for f in changed_files if f.endswith(".py") and ("backend/" in f or "server/" in f)]
-    if not py_files:
-        return ""
+    return [f for f in changed_files if f.endswith(".py") and ("backend/" in f or "server/" in f)]
 
-    # Simple logic: just find diff sections for Python files
-    # A more advanced version would parse the diff per file
-    py_diff_sections = []
-    for line in diff_content.splitlines():
-        if any(line.startswith(f"+++ b/{py_file}") for py_file in py_files):
-            py_diff_sections.append(f"\n--- Changes for {line.split('/')[-1]} ---\n")
-        if line.startswith(("+", "-")) and not line.startswith(("+++", "---")):
-            if py_diff_sections: # Only add diff content if we're in a relevant file section
-                py_diff_sections.append(line)
-    
-    if not py_diff_sections:
-        return ""
-        
-    py_diff = "\n".join(py_diff_sections)
+def get_frontend_files(changed_files):
+    """
+    Returns the changed React/TS files.
+    """
+    return [f for f in changed_files if ("web/src/" in f) and (f.endswith((".tsx", ".jsx", ".ts")))]
+
+class _DiffBuffer:
+    """
+    Collects diff lines for one language, stopping at the prompt size limit.
+    """
+
+    def __init__(self, limit=DIFF_CHAR_LIMIT):
+        self.buf = io.StringIO()
+        self.size = 0
+        self.limit = limit
+        self.full = False
 
-    # Truncate if diff is too large
-    if len(py_diff) > 4000:
-        py_diff = py_diff[:4000] + "\n... (diff truncated)"
+    def write(self, line):
+        if self.full:
+            return
+        n = len(line) + 1
+        if self.size + n > self.limit:
+            # Keep what fits, so one huge (e.g. minified) line still sends something
+            self.buf.write(line[:self.limit - self.size])
+            self.buf.write("\n... (diff truncated)")
+            self.full = True
+            return
+        self.buf.write(line)
+        self.buf.write("\n")
+        self.size += n
 
+    def getvalue(self):
+        return self.buf.getvalue()
+
+def split_diff_by_language(diff_lines, py_files, fe_files):
+    """
+    Partitions the diff into backend and frontend sections in a single pass.
+
+    `diff_lines` can be any iterable of byte lines (e.g. a file opened in
+    binary mode), so only the relevant lines are ever held in memory.
+    Whitespace-only changes are dropped, and each section is truncated to
+    DIFF_CHAR_LIMIT characters for the prompt.
+    """
+    py_paths = frozenset(p.encode() for p in py_files)
+    fe_paths = frozenset(p.encode() for p in fe_files)
+
+    buffers = {"py": _DiffBuffer(), "fe": _DiffBuffer()}
+    # Only languages with changed files can still receive lines
+    active = [buffers[lang] for lang, paths in (("py", py_paths), ("fe", fe_paths)) if paths]
+    current = None # Language of the file section we're in, if relevant
+    in_header = True # Between a "diff --git" line and the file's first hunk
+    old_path = None
+    for line in diff_lines:
+        line = line.rstrip(b"\r\n")
+        if line.startswith(b"diff --git "):
+            current = None
+            in_header = True
+            old_path = None
+        elif in_header:
+            if line.startswith(b"@@"):
+                in_header = False
+            elif m := _OLD_FILE_RE.match(line):
+                old_path = m.group(1)
+            elif m := _NEW_FILE_RE.match(line):
+                # Deleted files have "+++ /dev/null", so fall back to the old path
+                path = (m.group(1) or old_path or b"").strip()
+                current = "py" if path in py_paths else "fe" if path in fe_paths else None
+                if current:
+                    if all(b.full for b in active):
+                        break # Nothing more can make it into either prompt
+                    file_name = path.rsplit(b"/", 1)[-1].decode(errors="replace")
+                    buffers[current].write(f"\n--- Changes for {file_name} ---\n")
+        elif current and not buffers[current].full and _DIFF_LINE_RE.match(line):
+            # Blank changes add prompt tokens but no information
+            if len(line.strip()) <= 1:
+                continue
+            buffers[current].write(line.decode(errors="replace"))
+    return {lang: b.getvalue() for lang, b in buffers.items()}
+
+def build_api_context(openapi_content):
+    """
+    Builds the optional OpenAPI context block for backend prompts.
+    """
     # --- THIS IS THE FIX ---
     # Build the context string separately to avoid backslash in f-string expression
-    api_context = ""
-    if openapi_content:
-        # We create the string with \n here, outside the main prompt's {expression}
-        api_context = f"Context from openapi.yaml:\n{openapi_content[:1000]}"
+    if not openapi_content:
+        return ""
+    # We create the string with \n here, outside the main prompt's {expression}
+    api_context = f"Context from openapi.yaml:\n{openapi_content}"
     # --- END FIX ---
+    return api_context
 
-    prompt = f"""
+def build_python_prompt(py_diff, openapi_content):
+    """
+    Builds the Pytest/DRF instructions for a Python diff.
+    """
+    api_context = build_api_context(openapi_content)
+
+    return f"""
     You are a senior Python SWE reviewing a PR. Given the following git diff for Python files, generate suggested Pytest unit tests.
     
     - Focus *only* on the changed code.
@@ -103,50 +283,116 @@ def handle_python_changes(diff_content, changed_files, openapi_content):
     Git Diff:
     {py_diff}
     """
+
+def build_frontend_prompt(fe_diff):
+    """
+    Builds the Vitest/RTL instructions for a React/TS diff.
+    """
+    return f"""
+    You are a senior Frontend Engineer. Given the following git diff for React/TypeScript files, generate suggested Vitest + React Testing Library (RTL) tests.
+    
+    - Focus *only* on the changed components or hooks.
+    - Mock any API calls or external dependencies.
+    - Cover new UI states, user interactions, or logic.
+    - Return *only* the test code blocks, formatted in Markdown, with suggested file paths.
     
-    suggestions = call_llm(prompt)
-    return f"### 🐍 Backend Test Suggestions\n\n{suggestions}\n\n"
+    Git Diff:
+    {fe_diff}
+    """
+
+def handle_python_changes(py_diff, openapi_content):
+    """
+    Generates suggestions for Python code changes (Pytest, DRF tests).
+    """
+    if not py_diff:
+        return ""
+
+    suggestions = call_llm(build_python_prompt(py_diff, openapi_content))
+    return f"{PY_HEADER}\n\n{suggestions}\n\n"
 
 
-def handle_frontend_changes(diff_content, changed_files):
+def handle_frontend_changes(fe_diff):
     """
     Generates suggestions for React/TS code changes (Vitest, RTL).
     """
-    fe_files = [f for f in changed_files if ("web/src/" in f) and (f.endswith((".tsx", ".jsx", ".ts")))]
-    if not fe_files:
+    if not fe_diff:
         return ""
 
-    # Simple logic to find diff sections for frontend files
-    fe_diff_sections = []
-    for line in diff_content.splitlines():
-        if any(line.startswith(f"+++ b/{fe_file}") for fe_file in fe_files):
-            fe_diff_sections.append(f"\n--- Changes for {line.split('/')[-1]} ---\n")
-        if line.startswith(("+", "-")) and not line.startswith(("+++", "---")):
-            if fe_diff_sections:
-                fe_diff_sections.append(line)
-                
-    if not fe_diff_sections:
-        return ""
+    suggestions = call_llm(build_frontend_prompt(fe_diff))
+    return f"{FE_HEADER}\n\n{suggestions}\n\n"
+
+def handle_separately(py_diff, fe_diff, openapi_content):
+    """
+    Runs each language handler as its own LLM call.
+    """
+    jobs = []
+    # 1. Handle Python/Backend changes
+    if py_diff:
+        jobs.append((handle_python_changes, py_diff, openapi_content))
+    # 2. Handle React/Frontend changes
+    if fe_diff:
+        jobs.append((handle_frontend_changes, fe_diff))
+    # 3. Add more handlers here (e.g., for documentation, changelogs, etc.)
+    #    and bump max_workers to match.
 
-    fe_diff = "\n".join(fe_diff_sections)
+    if len(jobs) <= 1:
+        results = [fn(*job_args) for fn, *job_args in jobs]
+    else:
+        # The handlers are independent network calls, so run them side by side.
+        # Results are collected in submission order to keep the output stable.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(*job) for job in jobs]
+            results = [future.result() for future in futures]
+
+    return [suggestions for suggestions in results if suggestions]
 
-    if len(fe_diff) > 4000:
-        fe_diff = fe_diff[:4000] + "\n... (diff truncated)"
+def handle_all_changes(diff_sections, openapi_content):
+    """
+    Generates suggestions for both languages with a single LLM call.
+
+    Falls back to one call per language when only one language changed,
+    or when the model's completion does not contain both section markers.
+    """
+    py_diff = diff_sections["py"]
+    fe_diff = diff_sections["fe"]
+    if not (py_diff and fe_diff):
+        return handle_separately(py_diff, fe_diff, openapi_content)
+
+    api_context = build_api_context(openapi_content)
 
     prompt = f"""
-    You are a senior Frontend Engineer. Given the following git diff for React/TypeScript files, generate suggested Vitest + React Testing Library (RTL) tests.
+    You are a senior engineer reviewing a PR that touches both backend Python and frontend React/TypeScript code. Given the git diffs below, generate suggested tests for each.
     
-    - Focus *only* on the changed components or hooks.
-    - Mock any API calls or external dependencies.
-    - Cover new UI states, user interactions, or logic.
-    - Return *only* the test code blocks, formatted in Markdown, with suggested file paths.
+    - For the Python diff, write Pytest unit tests. If API endpoints (views.py, serializers.py) are touched, include DRF API tests using APIClient.
+    - For the frontend diff, write Vitest + React Testing Library (RTL) tests. Mock any API calls or external dependencies.
+    - Focus *only* on the changed code, covering edge cases, error conditions, new UI states and user interactions.
+    - Format the tests as Markdown code blocks with suggested file paths.
+    - Return exactly two sections: a line `## PY_TESTS` followed by the Python tests, then a line `## FE_TESTS` followed by the frontend tests. Write nothing outside these sections.
     
-    Git Diff:
+    {api_context}
+    
+    ### PYTHON DIFF
+    {py_diff}
+    
+    ### FRONTEND DIFF
     {fe_diff}
     """
-    
-    suggestions = call_llm(prompt)
-    return f"### ⚛️ Frontend Test Suggestions\n\n{suggestions}\n\n"
+
+    response, ok = request_llm(prompt, max_tokens=1500)
+    if not ok:
+        # The API itself failed; retrying per language would only fail again
+        return [f"{PY_HEADER}\n\n{response}\n\n", f"{FE_HEADER}\n\n{response}\n\n"]
+
+    # re.split with a capture group yields [preamble, label, body, label, body, ...]
+    parts = _SECTION_RE.split(response)
+    answers = dict(zip(parts[1::2], (part.strip() for part in parts[2::2])))
+    if not (answers.get("PY_TESTS") and answers.get("FE_TESTS")):
+        return handle_separately(py_diff, fe_diff, openapi_content)
+
+    return [
+        f"{PY_HEADER}\n\n{answers['PY_TESTS']}\n\n",
+        f"{FE_HEADER}\n\n{answers['FE_TESTS']}\n\n",
+    ]
 
 def main():
     parser = argparse.ArgumentParser(description="Generate AI suggestions for a PR.")
@@ -158,30 +404,25 @@ def main():
     args = parser.parse_args()
 
     # Read all necessary files
-    diff_content = get_file_content(args.diff)
     changed_files_list = get_file_content(args.changed_files)
-    openapi_content = get_file_content(args.openapi) if args.openapi else None
-    
-    if not diff_content or not changed_files_list:
+    # Only the head of the spec is used as prompt context, so don't read the rest
+    openapi_content = get_file_content(args.openapi, max_chars=1024) if args.openapi else None
+
+    if not changed_files_list or not os.path.isfile(args.diff):
         print("Error: Could not read diff or changed files list.")
         return
 
     changed_files = changed_files_list.splitlines()
-    
+    py_files = get_python_files(changed_files)
+    fe_files = get_frontend_files(changed_files)
+
     # --- Routing Logic ---
     all_suggestions = []
-    
-    # 1. Handle Python/Backend changes
-    py_suggestions = handle_python_changes(diff_content, changed_files, openapi_content)
-    if py_suggestions:
-        all_suggestions.append(py_suggestions)
-
-    # 2. Handle React/Frontend changes
-    fe_suggestions = handle_frontend_changes(diff_content, changed_files)
-    if fe_suggestions:
-        all_suggestions.append(fe_suggestions)
-    
-    # 3. Add more handlers here (e.g., for documentation, changelogs, etc.)
+    if py_files or fe_files: # Don't touch the diff at all if nothing relevant changed
+        # Stream the diff so the raw text is never held in memory in full
+        with open(args.diff, "rb", buffering=1024 * 1024) as diff_file:
+            diff_sections = split_diff_by_language(diff_file, py_files, fe_files)
+        all_suggestions = handle_all_changes(diff_sections, openapi_content)
 
     # --- Write Output ---
     output_content = "Here are some AI-generated suggestions based on your changes:\n\n"
@@ -190,8 +431,12 @@ def main():
     else:
         output_content += "\n---\n".join(all_suggestions)
         
-    with open(args.out, "w") as f:
+    # Write to a temp file and swap it in, so a cancelled run never
+    # leaves a half-written output behind
+    tmp_path = args.out + ".tmp"
+    with open(tmp_path, "w") as f:
         f.write(output_content)
+    os.replace(tmp_path, args.out)
         
     print(f"Suggestions written to {args.out}")
 
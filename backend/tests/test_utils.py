@@ -10,11 +10,32 @@ def test_add_numbers_negative():
     """Tests adding two negative numbers."""
     assert add_numbers(-1, -5) == -6
 
+def test_add_numbers_mixed_types():
+    """Tests adding an int and a float."""
+    assert add_numbers(1, 2.5) == 3.5
+
 def test_add_numbers_type_error():
     """Tests that non-numbers raise a TypeError."""
     with pytest.raises(TypeError):
         add_numbers("a", "b")
 
+def test_add_numbers_numeric_subclass():
+    """Tests that int subclasses (bool) are still accepted."""
+    assert add_numbers(True, 1) == 2
+
+def test_add_numbers_non_numeric_subclass_type_error():
+    """Tests that a str subclass still raises a TypeError."""
+    class Name(str):
+        pass
+
+    with pytest.raises(TypeError):
+        add_numbers(Name("a"), 1)
+
+def test_add_numbers_none_type_error():
+    """Tests that None raises a TypeError."""
+    with pytest.raises(TypeError):
+        add_numbers(None, 1)
+
 def test_get_greeting_with_name():
     """Tests the greeting with a name provided."""
     assert get_greeting("Alice") == "Hello, Alice!"
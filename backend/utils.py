@@ -1,11 +1,16 @@
 # backend/utils.py
 
+_NUM_TYPES = (int, float)
+_STRANGER = "Hello, stranger!"
+
 def add_numbers(a, b):
     """
     Adds two numbers together.
     """
-    if not (isinstance(a, (int, float)) and isinstance(b, (int, float))):
-        raise TypeError("Inputs must be numbers")
+    # Exact-type check first; isinstance only runs for subclasses (e.g. bool)
+    if not (type(a) in _NUM_TYPES and type(b) in _NUM_TYPES):
+        if not (isinstance(a, _NUM_TYPES) and isinstance(b, _NUM_TYPES)):
+            raise TypeError("Inputs must be numbers")
         
     return a + b
 
@@ -14,7 +19,7 @@ def get_greeting(name):
     Returns a greeting message.
     """
     if not name:
-        return "Hello, stranger!"
+        return _STRANGER
     return f"Hello, {name}!"
 
 def subtract_numbers(a, b):
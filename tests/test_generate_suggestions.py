@@ -0,0 +1,266 @@
+# tests/test_generate_suggestions.py
+import importlib.util
+from pathlib import Path
+
+import pytest
+import requests
+
+# The script lives under .github/scripts, which isn't a package, so load it by path
+_SCRIPT = Path(__file__).resolve().parent.parent / ".github" / "scripts" / "generate_suggestions.py"
+_spec = importlib.util.spec_from_file_location("generate_suggestions", _SCRIPT)
+gs = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(gs)
+
+
+@pytest.fixture
+def fake_llm(request, monkeypatch):
+    """Stubs request_llm with the parametrized (text, ok) result; returns the max_tokens of each call."""
+    calls = []
+
+    def fake_request_llm(prompt, max_tokens=800):
+        calls.append(max_tokens)
+        return request.param
+
+    monkeypatch.setattr(gs, "request_llm", fake_request_llm)
+    return calls
+
+
+@pytest.mark.parametrize("fake_llm", [("intro\n## PY_TESTS\npy tests\n## FE_TESTS\nfe tests\n", True)], indirect=True)
+def test_handle_all_changes_splits_batched_response(fake_llm):
+    """Tests that one batched call is split into both sections."""
+    result = gs.handle_all_changes({"py": "+a", "fe": "+b"}, None)
+    assert fake_llm == [1500]
+    assert result == [
+        f"{gs.PY_HEADER}\n\npy tests\n\n",
+        f"{gs.FE_HEADER}\n\nfe tests\n\n",
+    ]
+
+
+@pytest.mark.parametrize("fake_llm", [("no markers here", True)], indirect=True)
+def test_handle_all_changes_falls_back_without_markers(fake_llm):
+    """Tests that a completion without markers falls back to per-language calls."""
+    result = gs.handle_all_changes({"py": "+a", "fe": "+b"}, None)
+    assert sorted(fake_llm) == [800, 800, 1500]
+    assert len(result) == 2
+
+
+@pytest.mark.parametrize("fake_llm", [("Error calling Perplexity API: boom", False)], indirect=True)
+def test_handle_all_changes_does_not_retry_api_errors(fake_llm):
+    """Tests that an API failure is reported once instead of retried per language."""
+    result = gs.handle_all_changes({"py": "+a", "fe": "+b"}, None)
+    assert fake_llm == [1500]
+    assert all("boom" in section for section in result)
+
+
+@pytest.mark.parametrize("fake_llm", [("tests", True)], indirect=True)
+def test_handle_all_changes_single_language(fake_llm):
+    """Tests that only the changed language's handler is called."""
+    result = gs.handle_all_changes({"py": "+a", "fe": ""}, None)
+    assert fake_llm == [800]
+    assert result == [f"{gs.PY_HEADER}\n\ntests\n\n"]
+
+
+def _diff(*files):
+    """Builds git diff byte lines from (old_path, new_path, body_lines) tuples."""
+    lines = []
+    for old, new, body in files:
+        lines.append(f"diff --git a/{old or new} b/{new or old}\n")
+        lines.append(f"--- a/{old}\n" if old else "--- /dev/null\n")
+        lines.append(f"+++ b/{new}\n" if new else "+++ /dev/null\n")
+        lines.extend(f"{line}\n" for line in body)
+    return [line.encode() for line in lines]
+
+
+def test_split_diff_by_language_partitions_files():
+    """Tests that backend and frontend lines end up in their own sections."""
+    diff = _diff(
+        ("backend/a.py", "backend/a.py", ["@@ -1 +1 @@", "-x = 1", "+x = 2"]),
+        ("web/src/App.tsx", "web/src/App.tsx", ["@@ -0,0 +1 @@", "+const y = 1;"]),
+        ("README.md", "README.md", ["@@ -0,0 +1 @@", "+docs"]),
+    )
+    sections = gs.split_diff_by_language(diff, ["backend/a.py"], ["web/src/App.tsx"])
+    assert sections["py"] == "\n--- Changes for a.py ---\n\n-x = 1\n+x = 2\n"
+    assert sections["fe"] == "\n--- Changes for App.tsx ---\n\n+const y = 1;\n"
+
+
+def test_split_diff_by_language_deleted_file_not_credited_to_previous():
+    """Tests that a deleted irrelevant file's lines don't leak into the previous file."""
+    diff = _diff(
+        ("backend/a.py", "backend/a.py", ["@@ -0,0 +1 @@", "+x = 1"]),
+        ("docs/old.md", None, ["@@ -1 +0,0 @@", "-secret doc text"]),
+    )
+    sections = gs.split_diff_by_language(diff, ["backend/a.py"], [])
+    assert "secret doc text" not in sections["py"]
+
+
+def test_split_diff_by_language_deleted_relevant_file():
+    """Tests that a deleted file is matched by its old path."""
+    diff = _diff(("backend/gone.py", None, ["@@ -1 +0,0 @@", "-def gone(): pass"]))
+    sections = gs.split_diff_by_language(diff, ["backend/gone.py"], [])
+    assert "-def gone(): pass" in sections["py"]
+
+
+@pytest.fixture
+def fake_api(request, monkeypatch, tmp_path):
+    """Points the LLM cache at a temp dir and stubs the HTTP session.
+
+    The response body can be overridden by parametrizing the fixture.
+    """
+    posts = []
+    body = getattr(request, "param", b'{"choices":[{"message":{"content":"cached?"}}]}')
+
+    def fake_post(url, **kwargs):
+        posts.append(kwargs["data"])
+        response = requests.Response()
+        response.status_code = 200
+        response._content = body
+        return response
+
+    monkeypatch.setattr(gs, "API_KEY", "test-key")
+    monkeypatch.setattr(gs, "LLM_CACHE_DIR", tmp_path / "llm")
+    monkeypatch.setattr(gs._SESSION, "post", fake_post)
+    return posts
+
+
+def test_request_llm_caches_by_prompt_and_max_tokens(fake_api):
+    """Tests that repeat calls hit the cache and max_tokens is part of the key."""
+    assert gs.request_llm("prompt") == ("cached?", True)
+    assert gs.request_llm("prompt") == ("cached?", True)
+    assert len(fake_api) == 1
+
+    gs.request_llm("prompt", max_tokens=1500)
+    gs.request_llm("other prompt")
+    assert len(fake_api) == 3
+    assert len(list(gs.LLM_CACHE_DIR.glob("*.txt"))) == 3
+
+
+def test_request_llm_treats_corrupt_entry_as_miss(fake_api):
+    """Tests that an undecodable cache entry is ignored and refetched."""
+    gs.request_llm("prompt")
+    (entry,) = gs.LLM_CACHE_DIR.glob("*.txt")
+    entry.write_bytes(b"\xff\xfe\xfa")
+
+    assert gs.request_llm("prompt") == ("cached?", True)
+    assert len(fake_api) == 2
+
+
+def test_diff_buffer_truncates_at_limit():
+    """Tests that the buffer stops at the limit and marks the truncation."""
+    buf = gs._DiffBuffer(limit=10)
+    buf.write("+abcd")
+    buf.write("+efgh")
+    buf.write("+ignored")
+    assert buf.full
+    assert buf.getvalue() == "+abcd\n+efg\n... (diff truncated)"
+
+
+def test_diff_buffer_keeps_head_of_oversized_line():
+    """Tests that a single line longer than the limit still contributes its head."""
+    buf = gs._DiffBuffer(limit=8)
+    buf.write("+" + "x" * 100)
+    assert buf.getvalue() == "+xxxxxxx\n... (diff truncated)"
+
+
+def test_split_diff_by_language_drops_blank_keeps_repeats():
+    """Tests that whitespace-only changes are dropped but repeated code is kept."""
+    diff = _diff(("backend/a.py", "backend/a.py", [
+        "@@ -0,0 +1,2 @@", "+    return None", "+   ",
+        "@@ -0,0 +5,1 @@", "+    return None",
+    ]))
+    sections = gs.split_diff_by_language(diff, ["backend/a.py"], [])
+    assert sections["py"].count("+    return None") == 2
+    assert "+   \n" not in sections["py"]
+
+
+@pytest.fixture
+def run_main(monkeypatch, tmp_path):
+    """Runs main() via sys.argv with the given diff and changed files; returns the output path.
+
+    Passing `diff_lines=None` leaves the diff file missing.
+    """
+    def run(diff_lines, changed_files):
+        diff_path = tmp_path / "pr.diff"
+        if diff_lines is not None:
+            diff_path.write_bytes(b"".join(diff_lines))
+        list_path = tmp_path / "changed_files.list"
+        list_path.write_text("\n".join(changed_files))
+        out_path = tmp_path / "suggestions.md"
+        monkeypatch.setattr("sys.argv", [
+            "generate_suggestions.py",
+            "--diff", str(diff_path),
+            "--changed-files", str(list_path),
+            "--out", str(out_path),
+        ])
+        gs.main()
+        return out_path
+    return run
+
+
+@pytest.mark.parametrize("fake_llm", [("py tests", True)], indirect=True)
+def test_main_writes_output_atomically(fake_llm, run_main):
+    """Tests that the output is swapped into place and no temp file is left behind."""
+    diff = _diff(("backend/a.py", "backend/a.py", ["@@ -0,0 +1 @@", "+x = 1"]))
+    out_path = run_main(diff, ["backend/a.py"])
+    assert "py tests" in out_path.read_text()
+    assert not Path(f"{out_path}.tmp").exists()
+
+
+@pytest.mark.parametrize("fake_llm", [("py tests", True)], indirect=True)
+def test_main_keeps_previous_output_if_swap_fails(fake_llm, run_main, monkeypatch, tmp_path):
+    """Tests that a failed write never replaces an existing output file."""
+    (tmp_path / "suggestions.md").write_text("previous run")
+
+    def failing_replace(src, dst):
+        raise OSError("killed")
+
+    monkeypatch.setattr(gs.os, "replace", failing_replace)
+    diff = _diff(("backend/a.py", "backend/a.py", ["@@ -0,0 +1 @@", "+x = 1"]))
+    with pytest.raises(OSError):
+        run_main(diff, ["backend/a.py"])
+    assert (tmp_path / "suggestions.md").read_text() == "previous run"
+
+
+@pytest.mark.parametrize("fake_llm", [("unused", True)], indirect=True)
+def test_main_skips_diff_without_relevant_files(fake_llm, run_main, monkeypatch):
+    """Tests that the diff isn't opened and no LLM call is made when nothing relevant changed."""
+    opened = []
+
+    def recording_open(file, *args, **kwargs):
+        opened.append(str(file))
+        return open(file, *args, **kwargs)
+
+    monkeypatch.setattr(gs, "open", recording_open, raising=False)
+    diff = _diff(("README.md", "README.md", ["@@ -0,0 +1 @@", "+docs"]))
+    out_path = run_main(diff, ["README.md"])
+    assert not any(path.endswith("pr.diff") for path in opened)
+    assert fake_llm == []
+    assert out_path.read_text() == "AI analysis complete. No specific test suggestions for this diff."
+
+
+@pytest.mark.parametrize("fake_llm", [("unused", True)], indirect=True)
+def test_main_empty_diff_writes_no_suggestions(fake_llm, run_main):
+    """Tests that an empty (but present) diff produces the no-suggestions output."""
+    out_path = run_main([], ["backend/a.py"])
+    assert fake_llm == []
+    assert out_path.read_text() == "AI analysis complete. No specific test suggestions for this diff."
+
+
+def test_main_missing_diff_reports_error(run_main, capsys):
+    """Tests that a missing diff file is still reported as an error with no output."""
+    out_path = run_main(None, ["backend/a.py"])
+    assert "Could not read diff" in capsys.readouterr().out
+    assert not out_path.exists()
+
+
+@pytest.mark.parametrize("fake_api", [
+    b'{"choices":[{"message":{"content":null}}]}',
+    b'{"choices":null}',
+    b'{"choices":[]}',
+    b'not json',
+], indirect=True)
+def test_request_llm_rejects_malformed_response(fake_api):
+    """Tests that a response without a text completion is a parse error and isn't cached."""
+    text, ok = gs.request_llm("prompt")
+    assert not ok
+    assert text.startswith("Error parsing API response")
+    assert not list(gs.LLM_CACHE_DIR.glob("*.txt"))